@@ -0,0 +1,45 @@
+# Benchmarks EventTimeWindows on a stream whose arrival order is disturbed by log-normally distributed delays.
+# usage: PYTHONPATH=. python benchmarks/windowing.py [number of events]
+import sys
+import time
+import random
+
+import time_utils
+
+
+def generate_events(count, events_per_second=1000, median_delay_ms=200, seed=0):
+    rnd = random.Random(seed)
+    start = 1546300800000  # 2019-01-01T00:00:00Z in ms
+    events = []
+    for i in range(count):
+        event_time = start + i * 1000 // events_per_second
+        arrival_time = event_time + int(rnd.lognormvariate(0, 1) * median_delay_ms)
+        events.append((arrival_time, event_time, rnd.randrange(100)))
+    events.sort()
+    return [(event_time, key) for _, event_time, key in events]
+
+
+def run(name, events, **kwargs):
+    windows = time_utils.EventTimeWindows(**kwargs)
+    closed = 0
+    started = time.perf_counter()
+    for event_time, key in events:
+        windows.add(event_time, key=key)
+        for _ in windows.closed_windows():
+            closed += 1
+    for _ in windows.flush():
+        closed += 1
+    elapsed = time.perf_counter() - started
+    print(f'{name:<10} {len(events) / elapsed:>12,.0f} events/s {closed:>10,} windows {windows.late_events:>8,} late events')
+
+
+def main(count):
+    events = generate_events(count)
+    print(f'{count:,} events')
+    run('tumbling', events, size=60000, allowed_lateness=1000)
+    run('hopping', events, size=60000, slide=15000, allowed_lateness=1000)
+    run('session', events, gap=500, allowed_lateness=1000)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000000)
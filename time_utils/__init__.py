@@ -1,14 +1,25 @@
+import os
 import sys
 import re
+import json
+import mmap
+import array
+import struct
 import pytz
 import datetime
+import bisect
+import heapq
+import operator
 import calendar
 import logging
+import threading
+from collections import deque, namedtuple
+from collections.abc import Hashable
 from functools import partial
 from tzlocal import windows_tz
 from dateutil import parser as dateutil_parser
 from dateutil.relativedelta import relativedelta
-from dateutil.tz import tzoffset
+from dateutil.tz import tzoffset, tzutc
 
 
 logger = logging.getLogger(__name__)
@@ -30,12 +41,119 @@ ISO8601_DURATION = re.compile(
 # microsoft has their own timezone index ¿ⓧ_ⓧﮌ supporting those as well
 # https://docs.microsoft.com/en-us/windows-hardware/manufacture/desktop/default-time-zones
 
+# territory used by CLDR for the default mapping of windows timezone
+WORLD_TERRITORY = '001'
+
+WindowsTzIndex = namedtuple('WindowsTzIndex', ['tz_win', 'win_tz', 'win_territory_tz'])
+
+_windows_tz_index = None
+
+
+_tz_links = None
+
+
+def _read_tz_links():
+    # tzdata.zi lines of form "L <target> <link name>"
+    try:
+        with pytz.open_resource('tzdata.zi') as f:
+            lines = f.read().decode('utf-8').splitlines()
+    except (IOError, OSError, ValueError):
+        logger.debug('Could not read tzdata.zi, timezone links will not be resolved')
+        return {}
+    return {parts[2]: parts[1] for parts in (line.split() for line in lines if line.startswith('L ')) if len(parts) == 3}
+
+
+def _get_tz_links():
+    global _tz_links
+    if _tz_links is None:
+        _tz_links = _read_tz_links()
+    return _tz_links
+
+
+def _resolve_tz_link(tz_name):
+    links = _get_tz_links()
+    seen = set()
+    while tz_name in links and tz_name not in seen:
+        seen.add(tz_name)
+        tz_name = links[tz_name]
+    return tz_name
+
+
+def _build_windows_tz_index():
+    links = _get_tz_links()
+
+    win_names = {}
+    for win_name in windows_tz.win_tz:
+        win_names[win_name.lower()] = sys.intern(win_name)
+
+    canonical_win = {}
+    for tz, win_name in windows_tz.tz_win.items():
+        if not tz:
+            continue
+        win_name = win_names.setdefault(win_name.lower(), sys.intern(win_name))
+        key = _resolve_tz_link(tz)
+        if tz == key or key not in canonical_win:
+            canonical_win[key] = win_name
+
+    tz_win = {}
+    for tz in set(pytz.all_timezones) | set(links) | set(windows_tz.tz_win):
+        win_name = canonical_win.get(_resolve_tz_link(tz))
+        if tz and win_name:
+            tz_win[tz.lower()] = win_name
+
+    win_tz = {}
+    for win_name, tz in windows_tz.win_tz.items():
+        win_tz[win_name.lower()] = sys.intern(tz)
+
+    win_territory_tz = {}
+    for territory, tzs in pytz.country_timezones.items():
+        for tz in tzs:
+            win_name = tz_win.get(tz.lower())
+            if win_name:
+                win_territory_tz.setdefault((win_name.lower(), territory), sys.intern(tz))
+    for win_name, tz in win_tz.items():
+        win_territory_tz[(win_name, WORLD_TERRITORY)] = tz
+
+    return WindowsTzIndex(tz_win, win_tz, win_territory_tz)
+
+
+def get_windows_tz_index():
+    global _windows_tz_index
+    if _windows_tz_index is None:
+        _windows_tz_index = _tz_snapshot.windows_tz_index() if _tz_snapshot is not None else _build_windows_tz_index()
+    return _windows_tz_index
+
+
+def _tz_index_key(tz):
+    if not isinstance(tz, str):
+        raise KeyError(tz)
+    return tz.lower()
+
+
 def timezone_to_microsoft_timezone(tz):
-    return windows_tz.tz_win[tz]
+    return get_windows_tz_index().tz_win[_tz_index_key(tz)]
+
+
+def microsoft_timezone_to_timezone(tz, territory=None):
+    index = get_windows_tz_index()
+    if territory:
+        return index.win_territory_tz[(_tz_index_key(tz), _tz_index_key(territory).upper())]
+    return index.win_tz[_tz_index_key(tz)]
+
+
+def timezones_to_microsoft_timezones(tzs):
+    tz_win = get_windows_tz_index().tz_win
+    return [tz_win.get(tz.lower()) if isinstance(tz, str) else None for tz in tzs]
 
 
-def microsoft_timezone_to_timezone(tz):
-    return windows_tz.win_tz[tz]
+def microsoft_timezones_to_timezones(tzs, territory=None):
+    index = get_windows_tz_index()
+    if territory:
+        if not isinstance(territory, str):
+            return [None for _ in tzs]
+        territory = territory.upper()
+        return [index.win_territory_tz.get((tz.lower(), territory)) if isinstance(tz, str) else None for tz in tzs]
+    return [index.win_tz.get(tz.lower()) if isinstance(tz, str) else None for tz in tzs]
 
 
 def ensure_tz_object(tz_string_or_tz_obj):
@@ -54,8 +172,368 @@ def ensure_tz_object(tz_string_or_tz_obj):
         return pytz.timezone(tz)
 
 
+_canonical_tzs = []
+_canonical_tz_ids = {}  # canonical key -> canonical tz id
+_canonical_tz_cache = {}  # tz_string_or_tz_obj -> canonical tz id
+_unnamed_tzs = {}  # tzinfo type -> [(tz, canonical tz id)]
+_canonical_tz_lock = threading.Lock()
+
+
+def _tz_name(tz):
+    name = getattr(tz, 'zone', None) or getattr(tz, 'key', None)
+    if name:
+        return name
+    # dateutil tzfile knows only the file it was read from
+    filename = getattr(tz, '_filename', None)
+    if isinstance(filename, str):
+        return filename.rsplit('zoneinfo/', 1)[-1]
+    return None
+
+
+def _canonical_tz_key_and_obj(tz_string_or_tz_obj):
+    tz = ensure_tz_object(tz_string_or_tz_obj)
+    name = _tz_name(tz)
+    if name:
+        try:
+            name = _resolve_tz_link(ensure_tz_object(name).zone)
+        except (pytz.exceptions.UnknownTimeZoneError, KeyError, AttributeError):
+            return None, tz
+        tz = pytz.timezone(name)
+        # zones without transitions (e.g. UTC, Etc/GMT-2) are the same as fixed offsets
+        if not isinstance(tz, _FIXED_OFFSET_TZ_TYPES):
+            return ('zone', name), tz
+
+    if isinstance(tz, _FIXED_OFFSET_TZ_TYPES):
+        offset = int(tz.utcoffset(None).total_seconds())
+        if offset == 0:
+            return ('offset', 0), pytz.utc
+        if offset % 60 == 0:
+            return ('offset', offset), pytz.FixedOffset(offset // 60)
+        return ('offset', offset), datetime.timezone(datetime.timedelta(seconds=offset))
+
+    return None, tz
+
+
+def _register_canonical_tz(key, tz):
+    tz_id = _canonical_tz_ids.get(key)
+    if tz_id is None:
+        tz_id = _canonical_tz_ids[key] = len(_canonical_tzs)
+        _canonical_tzs.append(tz)
+    return tz_id
+
+
+def _register_unnamed_tz(tz):
+    # tzinfos without name or fixed offset (e.g. dateutil tzlocal) are canonicalized by equality,
+    # ones that only compare by identity cannot be canonicalized and are not registered
+    if type(tz).__eq__ is object.__eq__:
+        return None
+    same_type_tzs = _unnamed_tzs.setdefault(type(tz), [])
+    for registered_tz, tz_id in same_type_tzs:
+        if registered_tz == tz:
+            return tz_id
+    tz_id = _register_canonical_tz(('tz', type(tz), len(same_type_tzs)), tz)
+    same_type_tzs.append((tz, tz_id))
+    return tz_id
+
+
+def canonical_tz_id(tz_string_or_tz_obj):
+    try:
+        return _canonical_tz_cache[tz_string_or_tz_obj]
+    except (KeyError, TypeError):  # TypeError: some tzinfo implementations (e.g. tzoffset) are not hashable
+        pass
+
+    key, tz = _canonical_tz_key_and_obj(tz_string_or_tz_obj)
+    with _canonical_tz_lock:
+        tz_id = _register_unnamed_tz(tz) if key is None else _register_canonical_tz(key, tz)
+        if tz_id is not None and isinstance(tz_string_or_tz_obj, Hashable):
+            _canonical_tz_cache[tz_string_or_tz_obj] = tz_id
+    return tz_id
+
+
+def canonical_tz_ids(tz_strings_or_tz_objs):
+    return [canonical_tz_id(tz_string_or_tz_obj) for tz_string_or_tz_obj in tz_strings_or_tz_objs]
+
+
+def canonical_tz_by_id(tz_id):
+    return _canonical_tzs[tz_id]
+
+
+def canonical_tz(tz_string_or_tz_obj):
+    tz_id = canonical_tz_id(tz_string_or_tz_obj)
+    if tz_id is None:
+        return ensure_tz_object(tz_string_or_tz_obj)
+    return _canonical_tzs[tz_id]
+
+
+def is_same_tz(tz_string_or_tz_obj_1, tz_string_or_tz_obj_2):
+    tz_id_1 = canonical_tz_id(tz_string_or_tz_obj_1)
+    tz_id_2 = canonical_tz_id(tz_string_or_tz_obj_2)
+    if tz_id_1 is None or tz_id_2 is None:
+        return ensure_tz_object(tz_string_or_tz_obj_1) is ensure_tz_object(tz_string_or_tz_obj_2)
+    return tz_id_1 == tz_id_2
+
+
+UtcOffset = namedtuple('UtcOffset', ['offset', 'valid_until'])
+
+
+# tz_string_or_tz_obj -> (offset seconds, valid from, valid until), all times naive utc
+_utc_offset_cache = {}
+
+_FIXED_OFFSET_TZ_TYPES = (pytz.tzinfo.StaticTzInfo, type(pytz.utc), type(pytz.FixedOffset(60)), datetime.timezone, tzoffset, tzutc)
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+_SECOND = datetime.timedelta(seconds=1)
+
+# canonical tz id -> (transition times as epoch seconds, utc offsets in seconds), None if transitions are not known
+_utc_offset_tables = {}
+
+
+def _build_utc_offset_table(tz):
+    transition_times = getattr(tz, '_utc_transition_times', None)
+    if transition_times:
+        return (
+            [(transition_time - _EPOCH) // _SECOND for transition_time in transition_times],
+            [int(transition_info[0].total_seconds()) for transition_info in tz._transition_info]
+        )
+    if isinstance(tz, _FIXED_OFFSET_TZ_TYPES):
+        return [(datetime.datetime.min - _EPOCH) // _SECOND], [int(tz.utcoffset(None).total_seconds())]
+    return None
+
+
+def _get_utc_offset_table(tz_string_or_tz_obj):
+    if _tz_snapshot is not None and isinstance(tz_string_or_tz_obj, str):
+        table = _tz_snapshot.utc_offset_table(tz_string_or_tz_obj)
+        if table is not None:
+            return table
+
+    tz_id = canonical_tz_id(tz_string_or_tz_obj)
+    if tz_id is None:
+        return None
+    try:
+        return _utc_offset_tables[tz_id]
+    except KeyError:
+        table = _utc_offset_tables[tz_id] = _build_utc_offset_table(canonical_tz_by_id(tz_id))
+        return table
+
+
+def _utc_offset_period(tz_string_or_tz_obj, utc_now):
+    table = _get_utc_offset_table(tz_string_or_tz_obj)
+    if table is None:
+        # transitions are not known for this tzinfo implementation, so the offset is valid only for this moment
+        offset = int(pytz.utc.localize(utc_now).astimezone(ensure_tz_object(tz_string_or_tz_obj)).utcoffset().total_seconds())
+        return offset, utc_now, utc_now
+
+    transition_times, offsets = table
+    if len(offsets) == 1:
+        return offsets[0], None, None
+    i = max(bisect.bisect_right(transition_times, (utc_now - _EPOCH) // _SECOND) - 1, 0)
+    valid_from = _EPOCH + datetime.timedelta(seconds=transition_times[i])
+    valid_until = _EPOCH + datetime.timedelta(seconds=transition_times[i + 1]) if i + 1 < len(offsets) else None
+    return offsets[i], valid_from, valid_until
+
+
+def get_current_utc_offsets(tz_strings_or_tz_objs):
+    utc_now = datetime.datetime.utcnow()
+    ret = []
+    for tz_string_or_tz_obj in tz_strings_or_tz_objs:
+        try:
+            offset, valid_from, valid_until = _utc_offset_cache[tz_string_or_tz_obj]
+            if (valid_from is not None and utc_now < valid_from) or (valid_until is not None and utc_now >= valid_until):
+                raise KeyError(tz_string_or_tz_obj)
+        except (KeyError, TypeError):  # TypeError: some tzinfo implementations (e.g. tzoffset) are not hashable
+            offset, valid_from, valid_until = _utc_offset_period(tz_string_or_tz_obj, utc_now)
+            if (valid_from is None or valid_from != valid_until) and isinstance(tz_string_or_tz_obj, Hashable):
+                _utc_offset_cache[tz_string_or_tz_obj] = offset, valid_from, valid_until
+
+        ret.append(UtcOffset(offset, valid_until and pytz.utc.localize(valid_until)))
+    return ret
+
+
 def get_current_utc_offset(tz_string_or_tz_obj):
-    return int(ensure_tz_object(tz_string_or_tz_obj).utcoffset(datetime.datetime.utcnow()).total_seconds() / 3600)
+    return int(get_current_utc_offsets([tz_string_or_tz_obj])[0].offset / 3600)
+
+
+# Compiled timezone snapshot layout, all little-endian:
+#   header: magic, version, zone count, transition count, metadata offset, metadata length, pytz version
+#   zone records: (first transition index, transition count) as uint32 pairs
+#   transition times: int64 epoch seconds
+#   utc offsets: int32 seconds
+#   metadata: utf-8 json with zone names, links and windows timezone mappings
+TZ_SNAPSHOT_MAGIC = b'TUTZ'
+TZ_SNAPSHOT_VERSION = 2
+_TZ_SNAPSHOT_HEADER = struct.Struct('<4sIIIQQ32s')
+
+_tz_snapshot = None
+
+
+def _align(position, alignment=8):
+    return position + (-position % alignment)
+
+
+def _pytz_version():
+    return f'{pytz.__version__}/{pytz.OLSON_VERSION}'
+
+
+def _array_typecode(typecodes, itemsize):
+    # array and memoryview item sizes are platform dependent, pick the typecode matching the snapshot layout
+    for typecode in typecodes:
+        if array.array(typecode).itemsize == itemsize:
+            return typecode
+    raise ValueError(f'No {itemsize} byte array typecode in {typecodes}')
+
+
+_UINT32 = _array_typecode('IL', 4)
+_INT32 = _array_typecode('il', 4)
+_INT64 = _array_typecode('ql', 8)
+
+
+def _little_endian_bytes(typecode, values):
+    values = array.array(typecode, values)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _little_endian_view(view, typecode):
+    if sys.byteorder == 'little':
+        return view.cast(typecode)
+    # big-endian platforms cannot use the mapped data directly and get a private copy instead
+    values = array.array(typecode, view.tobytes())
+    values.byteswap()
+    return memoryview(values)
+
+
+def compile_tz_snapshot(path):
+    zone_names = []
+    zone_index = {}
+    names = {}
+    transition_times = []
+    offsets = []
+    records = []
+    for tz_name in pytz.all_timezones:
+        canonical = _resolve_tz_link(tz_name)
+        if canonical not in zone_index:
+            try:
+                table = _build_utc_offset_table(pytz.timezone(canonical))
+            except pytz.exceptions.UnknownTimeZoneError:
+                canonical = tz_name
+                table = _build_utc_offset_table(pytz.timezone(canonical))
+            if canonical not in zone_index:
+                zone_index[canonical] = len(zone_names)
+                zone_names.append(canonical)
+                records.append((len(offsets), len(table[1])))
+                transition_times.extend(table[0])
+                offsets.extend(table[1])
+        names[tz_name.lower()] = zone_index[canonical]
+        names[canonical.lower()] = zone_index[canonical]
+
+    windows_tz_index = _build_windows_tz_index()
+    metadata = json.dumps({
+        'zones': zone_names,
+        'names': names,
+        'tz_win': windows_tz_index.tz_win,
+        'win_tz': windows_tz_index.win_tz,
+        'win_territory_tz': [[win_name, territory, tz] for (win_name, territory), tz in windows_tz_index.win_territory_tz.items()]
+    }, separators=(',', ':')).encode('utf-8')
+
+    records_offset = _TZ_SNAPSHOT_HEADER.size
+    transition_times_offset = _align(records_offset + 8 * len(records))
+    offsets_offset = transition_times_offset + 8 * len(transition_times)
+    metadata_offset = _align(offsets_offset + 4 * len(offsets))
+
+    buffer = bytearray(metadata_offset + len(metadata))
+    _TZ_SNAPSHOT_HEADER.pack_into(
+        buffer, 0, TZ_SNAPSHOT_MAGIC, TZ_SNAPSHOT_VERSION, len(records), len(offsets), metadata_offset, len(metadata), _pytz_version().encode('ascii')
+    )
+    buffer[records_offset:records_offset + 8 * len(records)] = _little_endian_bytes(_UINT32, [value for record in records for value in record])
+    buffer[transition_times_offset:offsets_offset] = _little_endian_bytes(_INT64, transition_times)
+    buffer[offsets_offset:offsets_offset + 4 * len(offsets)] = _little_endian_bytes(_INT32, offsets)
+    buffer[metadata_offset:] = metadata
+
+    # write to temporary file first so that workers never map a partially written snapshot
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(buffer)
+    os.replace(tmp_path, path)
+    return path
+
+
+class TzSnapshot:
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _TZ_SNAPSHOT_HEADER.size:
+            raise ValueError(f'{path} is not a version {TZ_SNAPSHOT_VERSION} timezone snapshot')
+        magic, version, zone_count, transition_count, metadata_offset, metadata_length, pytz_version = _TZ_SNAPSHOT_HEADER.unpack_from(self._mmap, 0)
+        if magic != TZ_SNAPSHOT_MAGIC or version != TZ_SNAPSHOT_VERSION:
+            raise ValueError(f'{path} is not a version {TZ_SNAPSHOT_VERSION} timezone snapshot')
+        pytz_version = pytz_version.rstrip(b'\0').decode('ascii')
+        if pytz_version != _pytz_version():
+            raise ValueError(f'{path} was compiled with pytz {pytz_version}, installed pytz is {_pytz_version()}')
+
+        records_offset = _TZ_SNAPSHOT_HEADER.size
+        transition_times_offset = _align(records_offset + 8 * zone_count)
+        offsets_offset = transition_times_offset + 8 * transition_count
+        # catches snapshots that are truncated, e.g. still being copied into place
+        if metadata_offset < offsets_offset + 4 * transition_count or metadata_offset + metadata_length > len(self._mmap):
+            raise ValueError(f'{path} is truncated, expected {metadata_offset + metadata_length} bytes, got {len(self._mmap)}')
+        view = memoryview(self._mmap)
+        self._records = _little_endian_view(view[records_offset:records_offset + 8 * zone_count], _UINT32)
+        self._transition_times = _little_endian_view(view[transition_times_offset:offsets_offset], _INT64)
+        self._offsets = _little_endian_view(view[offsets_offset:offsets_offset + 4 * transition_count], _INT32)
+        self._metadata_slice = slice(metadata_offset, metadata_offset + metadata_length)
+        self._metadata = None
+        self._tables = {}
+
+    def _get_metadata(self):
+        if self._metadata is None:
+            self._metadata = json.loads(bytes(self._mmap[self._metadata_slice]).decode('utf-8'))
+        return self._metadata
+
+    @property
+    def zones(self):
+        return self._get_metadata()['zones']
+
+    def zone_table(self, zone_index):
+        try:
+            return self._tables[zone_index]
+        except KeyError:
+            pass
+        start, count = self._records[2 * zone_index], self._records[2 * zone_index + 1]
+        table = self._tables[zone_index] = self._transition_times[start:start + count], self._offsets[start:start + count]
+        return table
+
+    def utc_offset_table(self, tz_name):
+        metadata = self._get_metadata()
+        key = tz_name.lower()
+        zone_index = metadata['names'].get(key)
+        if zone_index is None:
+            # windows timezone name
+            tz_name = metadata['win_tz'].get(key)
+            if tz_name is None:
+                return None
+            zone_index = metadata['names'].get(tz_name.lower())
+        return self.zone_table(zone_index)
+
+    def windows_tz_index(self):
+        metadata = self._get_metadata()
+        return WindowsTzIndex(
+            metadata['tz_win'],
+            metadata['win_tz'],
+            {(win_name, territory): tz for win_name, territory, tz in metadata['win_territory_tz']}
+        )
+
+
+def use_tz_snapshot(path=None):
+    global _tz_snapshot, _windows_tz_index
+    _tz_snapshot = TzSnapshot(path) if path else None
+    _windows_tz_index = None
+    _utc_offset_tables.clear()
+    _utc_offset_cache.clear()
+    return _tz_snapshot
 
 
 def today(tz_string_or_tz_obj):
@@ -88,15 +566,19 @@ def datetime_from_timestamp(timestamp, tz_string_or_tz_obj=None, is_ms=False):
 def localize(datetime_obj, tz_string_or_tz_obj, overwrite=False):
     tz = ensure_tz_object(tz_string_or_tz_obj)
     if overwrite:
-        return tz.localize(datetime_obj.replace(tzinfo=None))
-    else:
+        datetime_obj = datetime_obj.replace(tzinfo=None)
+    if hasattr(tz, 'localize'):
         return tz.localize(datetime_obj)
+    # tzinfos other than pytz ones (e.g. sub-minute fixed offsets) are attached directly
+    if datetime_obj.tzinfo is not None:
+        raise ValueError('Not naive datetime (tzinfo is already set)')
+    return datetime_obj.replace(tzinfo=tz)
 
 
 def get_maybe_tz_from_date_objects(*date_objects):
     for date_object in date_objects:
         if type(date_object) == datetime.datetime and date_object.tzinfo:
-            return date_object.tzinfo
+            return canonical_tz(date_object.tzinfo)
     return pytz.utc
 
 
@@ -241,6 +723,131 @@ def datetime_parse(datetime_str, default_tz=None):
         return dt
 
 
+_TIMESPECS = {'auto', 'minutes', 'seconds', 'milliseconds', 'microseconds'}
+
+_offset_suffix_cache = {}  # (utc offset seconds, use_z) -> suffix
+
+_DATE_PREFIX_CACHE_SIZE = 4096
+_date_prefix_cache = {}  # date ordinal -> YYYY-MM-DDT
+
+
+def _offset_suffix(offset_seconds, use_z):
+    key = offset_seconds, use_z
+    try:
+        return _offset_suffix_cache[key]
+    except KeyError:
+        pass
+
+    if offset_seconds is None:
+        suffix = ''
+    elif offset_seconds == 0 and use_z:
+        suffix = 'Z'
+    else:
+        hours, rest = divmod(abs(offset_seconds), 3600)
+        minutes, seconds = divmod(rest, 60)
+        suffix = f'{"-" if offset_seconds < 0 else "+"}{hours:02d}:{minutes:02d}'
+        if seconds:
+            suffix += f':{seconds:02d}'
+    _offset_suffix_cache[key] = suffix
+    return suffix
+
+
+def _date_prefix(ordinal):
+    try:
+        return _date_prefix_cache[ordinal]
+    except KeyError:
+        pass
+
+    if len(_date_prefix_cache) >= _DATE_PREFIX_CACHE_SIZE:
+        _date_prefix_cache.clear()
+    date_obj = datetime.date.fromordinal(ordinal)
+    prefix = _date_prefix_cache[ordinal] = f'{date_obj.year:04d}-{date_obj.month:02d}-{date_obj.day:02d}T'
+    return prefix
+
+
+_HOUR_MINUTE_STRS = tuple('%02d:%02d' % divmod(minutes, 60) for minutes in range(24 * 60))
+_SECOND_STRS = tuple(':%02d' % second for second in range(60))
+
+
+def _format_time(hour, minute, second, microsecond, timespec):
+    hour_minute = _HOUR_MINUTE_STRS[hour * 60 + minute]
+    if timespec == 'minutes':
+        return hour_minute
+    elif timespec == 'milliseconds':
+        return hour_minute + _SECOND_STRS[second] + '.%03d' % (microsecond // 1000)
+    elif timespec == 'microseconds' or (timespec == 'auto' and microsecond):
+        return hour_minute + _SECOND_STRS[second] + '.%06d' % microsecond
+    else:
+        return hour_minute + _SECOND_STRS[second]
+
+
+def _check_timespec(timespec):
+    if timespec not in _TIMESPECS:
+        raise ValueError(f'Unknown timespec "{timespec}"')
+
+
+def _join_formatted(formatted, separator):
+    if separator is None:
+        return formatted
+    if isinstance(separator, str):
+        separator = separator.encode('ascii')
+    return separator.join(value.encode('ascii') for value in formatted)
+
+
+def _datetime_format(datetime_obj, timespec, use_z, suffixes):
+    offset = datetime_obj.utcoffset()
+    try:
+        suffix = suffixes[offset]
+    except KeyError:
+        suffix = suffixes[offset] = _offset_suffix(None if offset is None else offset.days * 86400 + offset.seconds, use_z)
+    return (
+        _date_prefix(datetime_obj.toordinal())
+        + _format_time(datetime_obj.hour, datetime_obj.minute, datetime_obj.second, datetime_obj.microsecond, timespec)
+        + suffix
+    )
+
+
+def datetime_format(datetime_obj, timespec='auto', use_z=True):
+    _check_timespec(timespec)
+    return _datetime_format(datetime_obj, timespec, use_z, {})
+
+
+def datetimes_format(datetime_objs, timespec='auto', use_z=True, separator=None):
+    _check_timespec(timespec)
+    suffixes = {}  # utcoffset -> suffix, saves converting the same offsets to seconds for every value
+    return _join_formatted([_datetime_format(datetime_obj, timespec, use_z, suffixes) for datetime_obj in datetime_objs], separator)
+
+
+def timestamps_format(timestamps, tz_string_or_tz_obj=None, is_ms=False, timespec='auto', use_z=True, separator=None):
+    _check_timespec(timespec)
+    tz = tz_string_or_tz_obj or 'UTC'
+    table = _get_utc_offset_table(tz)
+    if table is None:
+        suffixes = {}
+        return _join_formatted([
+            _datetime_format(datetime_from_timestamp(timestamp, tz, is_ms), timespec, use_z, suffixes) for timestamp in timestamps
+        ], separator)
+
+    transition_times, offsets = table
+    fixed_offset = offsets[0] if len(offsets) == 1 else None
+    unit = 1000 if is_ms else 1000000
+    formatted = []
+    for timestamp in timestamps:
+        micros = timestamp * unit
+        if not isinstance(micros, int):
+            micros = int(round(micros))
+        if fixed_offset is None:
+            offset = offsets[bisect.bisect_right(transition_times, micros // 1000000) - 1]
+        else:
+            offset = fixed_offset
+        days, micros = divmod(micros + offset * 1000000, 86400000000)
+        seconds, microsecond = divmod(micros, 1000000)
+        minutes, second = divmod(seconds, 60)
+        hour, minute = divmod(minutes, 60)
+        formatted.append(_date_prefix(_EPOCH_ORDINAL + days) + _format_time(hour, minute, second, microsecond, timespec) + _offset_suffix(offset, use_z))
+    return _join_formatted(formatted, separator)
+
+
 def is_business_day(date_obj):
     # mon - fri
     iso_business_days = [1, 2, 3, 4, 5]
@@ -274,6 +881,196 @@ def floor_datetime(datetime_obj, delta=None, **delta_kwargs):
     return datetime_obj - (datetime_obj - min_datetime) % delta
 
 
+Window = namedtuple('Window', ['key', 'start', 'end', 'value'])  # end is exclusive
+
+_SESSION_HEAP_COMPACT_FACTOR = 2
+_SESSION_HEAP_COMPACT_MIN_SIZE = 64
+
+
+def _count_event(count, value):
+    return count + 1
+
+
+class EventTimeWindows:
+    # Assigns out of order events to tumbling (size), hopping (size and slide) or session (gap) windows.
+    # Timestamps and durations are integers in the same unit, e.g. epoch ms. Windows are aligned to 0,
+    # which is the integer counterpart of floor_datetime for durations that divide a day.
+    # Watermark trails the largest seen timestamp by allowed_lateness, windows are closed when the watermark
+    # passes their end. By default windows count their events, initializer, reducer and merger (sessions)
+    # can be given to aggregate values instead.
+
+    def __init__(self, size=None, slide=None, gap=None, allowed_lateness=0, max_open_windows=None,
+                 initializer=int, reducer=_count_event, merger=None):
+        if (size is None) == (gap is None):
+            raise ValueError('Either size or gap must be given')
+        if gap is not None and slide is not None:
+            raise ValueError('Session windows do not support slide')
+        if (size is not None and size <= 0) or (gap is not None and gap <= 0) or (slide is not None and slide <= 0):
+            raise ValueError('Window size, slide and gap must be positive')
+        if slide is not None and slide > size:
+            raise ValueError('Window slide must not be larger than size')
+        if max_open_windows is not None and max_open_windows < 0:
+            raise ValueError('Max open windows must not be negative')
+        if gap is not None and merger is None:
+            if reducer is not _count_event:
+                raise ValueError('Session windows with custom reducer need merger')
+            merger = operator.add
+
+        self.size = size
+        self.slide = slide or size
+        self.gap = gap
+        self.allowed_lateness = allowed_lateness
+        self.max_open_windows = max_open_windows
+        self.initializer = initializer
+        self.reducer = reducer
+        self.merger = merger
+
+        self.watermark = None
+        self.late_events = 0
+        self._max_timestamp = None
+        self._windows = {}  # tumbling and hopping: (key, start) -> accumulator, sessions: key -> [[start, end, accumulator]]
+        self._open_count = 0
+        self._ends = []  # heap of (end, sequence, key, start)
+        self._closed = deque()  # windows closed early because of max_open_windows
+        self._closed_session_ends = {}  # key -> end of the latest popped session
+        self._closed_session_ends_limit = _SESSION_HEAP_COMPACT_MIN_SIZE
+        self._sequence = 0
+
+    def __len__(self):
+        return self._open_count
+
+    def _push_end(self, end, key, start):
+        self._sequence += 1
+        heapq.heappush(self._ends, (end, self._sequence, key, start))
+
+    def _advance_watermark(self, watermark):
+        if self.watermark is None or watermark > self.watermark:
+            self.watermark = watermark
+
+    def _add_to_windows(self, timestamp, value, key):
+        watermark = self.watermark
+        start = timestamp - timestamp % self.slide
+        assigned = False
+        while start + self.size > timestamp:
+            end = start + self.size
+            if watermark is None or end > watermark:
+                window_key = key, start
+                try:
+                    accumulator = self._windows[window_key]
+                except KeyError:
+                    accumulator = self.initializer()
+                    self._open_count += 1
+                    self._push_end(end, key, start)
+                self._windows[window_key] = self.reducer(accumulator, value)
+                assigned = True
+            start -= self.slide
+        return assigned
+
+    def _add_to_sessions(self, timestamp, value, key):
+        end = timestamp + self.gap
+        watermark = self.watermark
+        sessions = self._windows.setdefault(key, [])
+        overlapping = [session for session in sessions if session[0] < end and timestamp < session[1]]
+        if watermark is not None and (
+            (not overlapping and end <= watermark)
+            # sessions ended before the watermark are closed even if they have not been emitted yet
+            or any(session[1] <= watermark for session in overlapping)
+            # an event starting before the end of the latest popped session either overlaps it or ends before the watermark
+            or timestamp < self._closed_session_ends.get(key, timestamp)
+        ):
+            if not sessions:
+                del self._windows[key]
+            return False
+
+        session = [timestamp, end, self.reducer(self.initializer(), value)]
+        for other in overlapping:
+            sessions.remove(other)
+            session[0] = min(session[0], other[0])
+            session[1] = max(session[1], other[1])
+            session[2] = self.merger(other[2], session[2])
+        sessions.append(session)
+        self._open_count += 1 - len(overlapping)
+        # heap entries of the merged sessions are left in place and skipped when popped,
+        # the heap is rebuilt once they outnumber the open sessions
+        self._push_end(session[1], key, session[0])
+        if len(self._ends) > _SESSION_HEAP_COMPACT_FACTOR * self._open_count + _SESSION_HEAP_COMPACT_MIN_SIZE:
+            self._compact_ends()
+        return True
+
+    def _compact_ends(self):
+        self._ends = []
+        for key, sessions in self._windows.items():
+            for start, end, _ in sessions:
+                self._sequence += 1
+                self._ends.append((end, self._sequence, key, start))
+        heapq.heapify(self._ends)
+
+    def add(self, timestamp, value=None, key=None):
+        if self.gap is None:
+            assigned = self._add_to_windows(timestamp, value, key)
+        else:
+            assigned = self._add_to_sessions(timestamp, value, key)
+        if not assigned:
+            self.late_events += 1
+
+        if self._max_timestamp is None or timestamp > self._max_timestamp:
+            self._max_timestamp = timestamp
+            self._advance_watermark(timestamp - self.allowed_lateness)
+
+        if self.max_open_windows is not None:
+            while self._open_count > self.max_open_windows:
+                # force the earliest window closed to keep memory bounded
+                window = self._pop_window()
+                if window is not None:
+                    self._open_count -= 1
+                    self._advance_watermark(window.end)
+                    self._closed.append(window)
+        return assigned
+
+    def _pop_window(self):
+        end, _, key, start = heapq.heappop(self._ends)
+        if self.gap is None:
+            return Window(key, start, end, self._windows.pop((key, start)))
+
+        sessions = self._windows.get(key, [])
+        for session in sessions:
+            if session[0] == start and session[1] == end:
+                sessions.remove(session)
+                if not sessions:
+                    del self._windows[key]
+                self._closed_session_ends[key] = max(end, self._closed_session_ends.get(key, end))
+                if len(self._closed_session_ends) > self._closed_session_ends_limit:
+                    self._compact_closed_session_ends()
+                return Window(key, start, end, session[2])
+        return None  # session was merged into another one after this entry was pushed
+
+    def _compact_closed_session_ends(self):
+        # events for sessions that would end before the watermark are late anyway, so old ends are not needed
+        watermark = self.watermark if self.watermark is not None else self._max_timestamp
+        self._closed_session_ends = {
+            key: end for key, end in self._closed_session_ends.items() if watermark is None or end + self.gap > watermark
+        }
+        self._closed_session_ends_limit = _SESSION_HEAP_COMPACT_FACTOR * len(self._closed_session_ends) + _SESSION_HEAP_COMPACT_MIN_SIZE
+
+    def closed_windows(self):
+        while self._closed:
+            yield self._closed.popleft()
+        while self._ends and self.watermark is not None and self._ends[0][0] <= self.watermark:
+            window = self._pop_window()
+            if window is not None:
+                self._open_count -= 1
+                yield window
+
+    def flush(self):
+        while self._closed:
+            yield self._closed.popleft()
+        while self._ends:
+            window = self._pop_window()
+            if window is not None:
+                self._open_count -= 1
+                yield window
+
+
 def get_next_even_15_minutes(datetime_obj):
     return ceil_datetime(datetime_obj, datetime.timedelta(minutes=15))
 
@@ -287,6 +1084,119 @@ def last_moment_of_month(year, month, timezone):
     return end_of_day(datetime.date(year, month, day), timezone)
 
 
+PERIODS = ('day', 'iso_week', 'month', 'quarter', 'year', 'fiscal_quarter', 'fiscal_year')
+
+PeriodBounds = namedtuple('PeriodBounds', ['start', 'end'])  # end is exclusive
+
+_EPOCH_UTC = pytz.utc.localize(_EPOCH)
+
+_MONTH_INDEX_CACHE_SIZE = 4096
+_month_index_cache = {}  # local days since epoch -> year * 12 + month - 1
+
+
+def _check_period(period, fiscal_year_start_month):
+    if period not in PERIODS:
+        raise ValueError(f'Unknown period "{period}"')
+    if not 1 <= fiscal_year_start_month <= 12:
+        raise ValueError(f'Invalid fiscal year start month "{fiscal_year_start_month}"')
+
+
+def _fiscal_month_shift(fiscal_year_start_month):
+    # fiscal year is named by the calendar year it ends in
+    return (13 - fiscal_year_start_month) % 12
+
+
+def _month_index(day):
+    try:
+        return _month_index_cache[day]
+    except KeyError:
+        pass
+
+    if len(_month_index_cache) >= _MONTH_INDEX_CACHE_SIZE:
+        _month_index_cache.clear()
+    date_obj = datetime.date.fromordinal(day + _EPOCH_ORDINAL)
+    month_index = _month_index_cache[day] = date_obj.year * 12 + date_obj.month - 1
+    return month_index
+
+
+def _local_days(values, tz_string_or_tz_obj, is_ms):
+    table = _get_utc_offset_table(tz_string_or_tz_obj)
+    transition_times, offsets = table or (None, None)
+    fixed_offset = offsets[0] if offsets and len(offsets) == 1 else None
+    for value in values:
+        if isinstance(value, datetime.datetime):
+            if value.tzinfo is None:  # naive datetime is already in local time
+                yield value.toordinal() - _EPOCH_ORDINAL
+                continue
+            seconds = (value - _EPOCH_UTC) // _SECOND
+        elif isinstance(value, datetime.date):
+            yield value.toordinal() - _EPOCH_ORDINAL
+            continue
+        else:
+            seconds = int(value // 1000 if is_ms else value // 1)
+
+        if table is None:
+            yield datetime_from_timestamp(seconds, tz_string_or_tz_obj).toordinal() - _EPOCH_ORDINAL
+        elif fixed_offset is not None:
+            yield (seconds + fixed_offset) // 86400
+        else:
+            yield (seconds + offsets[bisect.bisect_right(transition_times, seconds) - 1]) // 86400
+
+
+def period_keys(values, period, tz_string_or_tz_obj='UTC', is_ms=False, fiscal_year_start_month=1):
+    _check_period(period, fiscal_year_start_month)
+    days = _local_days(values, tz_string_or_tz_obj, is_ms)
+    shift = _fiscal_month_shift(fiscal_year_start_month)
+    if period == 'day':
+        return list(days)
+    elif period == 'iso_week':
+        # 1970-01-01 is thursday, so monday of the first week is day -3
+        return [(day + 3) // 7 for day in days]
+    elif period == 'month':
+        return [_month_index(day) for day in days]
+    elif period == 'quarter':
+        return [_month_index(day) // 3 for day in days]
+    elif period == 'year':
+        return [_month_index(day) // 12 for day in days]
+    elif period == 'fiscal_quarter':
+        return [(_month_index(day) + shift) // 3 for day in days]
+    else:
+        return [(_month_index(day) + shift) // 12 for day in days]
+
+
+def _period_dates(key, period, shift):
+    if period == 'day':
+        start = datetime.date.fromordinal(key + _EPOCH_ORDINAL)
+        return start, start + datetime.timedelta(days=1)
+    elif period == 'iso_week':
+        start = datetime.date.fromordinal(key * 7 - 3 + _EPOCH_ORDINAL)
+        return start, start + datetime.timedelta(days=7)
+
+    months = {'month': 1, 'quarter': 3, 'year': 12, 'fiscal_quarter': 3, 'fiscal_year': 12}[period]
+    start_month_index = key * months - (shift if period.startswith('fiscal_') else 0)
+    end_month_index = start_month_index + months
+    return (
+        datetime.date(start_month_index // 12, start_month_index % 12 + 1, 1),
+        datetime.date(end_month_index // 12, end_month_index % 12 + 1, 1)
+    )
+
+
+def period_bounds(keys, period, tz_string_or_tz_obj='UTC', fiscal_year_start_month=1):
+    _check_period(period, fiscal_year_start_month)
+    tz = canonical_tz(tz_string_or_tz_obj)
+    shift = _fiscal_month_shift(fiscal_year_start_month)
+    bounds = {}
+    ret = []
+    for key in keys:
+        try:
+            ret.append(bounds[key])
+        except KeyError:
+            start, end = _period_dates(key, period, shift)
+            key_bounds = bounds[key] = PeriodBounds(beginning_of_day(start, tz), beginning_of_day(end, tz))
+            ret.append(key_bounds)
+    return ret
+
+
 def _parse_single_duration_value(val):
     if val is None:
         return 0
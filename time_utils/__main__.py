@@ -0,0 +1,20 @@
+import argparse
+
+from time_utils import compile_tz_snapshot
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m time_utils')
+    subparsers = parser.add_subparsers(dest='command')
+    snapshot_parser = subparsers.add_parser('compile-tz-snapshot', help='compile timezone transitions and windows timezone mappings into a snapshot file')
+    snapshot_parser.add_argument('path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compile-tz-snapshot':
+        print(compile_tz_snapshot(args.path))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
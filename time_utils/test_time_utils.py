@@ -1,9 +1,11 @@
+import struct
 import datetime
 import pytz
 import pytest
 from freezegun import freeze_time
 from dateutil import parser as dateutil_parser
 from dateutil.relativedelta import relativedelta
+from dateutil import tz as dateutil_tz
 from dateutil.tz import tzoffset
 from unittest.mock import patch
 
@@ -97,6 +99,52 @@ def test_timezone_to_microsoft_timezone():
     assert 'FLE Standard Time' == time_utils.timezone_to_microsoft_timezone('Europe/Helsinki')
 
 
+def test_timezone_to_microsoft_timezone_case_insensitive():
+    assert 'FLE Standard Time' == time_utils.timezone_to_microsoft_timezone('europe/helsinki')
+
+
+def test_timezone_to_microsoft_timezone_link():
+    assert 'Eastern Standard Time' == time_utils.timezone_to_microsoft_timezone('US/Eastern')
+    assert 'India Standard Time' == time_utils.timezone_to_microsoft_timezone('Asia/Calcutta')
+
+
+def test_timezone_to_microsoft_timezone_raises():
+    with pytest.raises(KeyError):
+        time_utils.timezone_to_microsoft_timezone('asd asd')
+
+
+def test_microsoft_timezone_to_timezone_territory():
+    assert 'Europe/Helsinki' == time_utils.microsoft_timezone_to_timezone('fle standard time', 'FI')
+    assert 'America/Toronto' == time_utils.microsoft_timezone_to_timezone('Eastern Standard Time', 'ca')
+    assert 'Europe/Kiev' == time_utils.microsoft_timezone_to_timezone('FLE Standard Time', time_utils.WORLD_TERRITORY)
+
+
+def test_microsoft_timezone_mapping_non_str_raises_key_error():
+    with pytest.raises(KeyError):
+        time_utils.timezone_to_microsoft_timezone(None)
+    with pytest.raises(KeyError):
+        time_utils.microsoft_timezone_to_timezone(None)
+    assert [None] == time_utils.microsoft_timezones_to_timezones([None])
+    assert [None] == time_utils.timezones_to_microsoft_timezones([None])
+
+
+def test_microsoft_timezone_mapping_non_str_territory():
+    with pytest.raises(KeyError):
+        time_utils.microsoft_timezone_to_timezone('FLE Standard Time', 5)
+    assert [None, None] == time_utils.microsoft_timezones_to_timezones(['FLE Standard Time', None], 5)
+
+
+def test_ensure_tz_object_none_raises():
+    with pytest.raises(pytz.exceptions.UnknownTimeZoneError):
+        time_utils.ensure_tz_object(None)
+
+
+def test_bulk_microsoft_timezone_mapping():
+    assert ['Europe/Kiev', None] == time_utils.microsoft_timezones_to_timezones(['FLE Standard Time', 'asd asd'])
+    assert ['Europe/Helsinki', None] == time_utils.microsoft_timezones_to_timezones(['FLE Standard Time', 'Eastern Standard Time'], 'FI')
+    assert ['FLE Standard Time', None] == time_utils.timezones_to_microsoft_timezones(['Europe/Helsinki', 'asd asd'])
+
+
 def test_ensure_tz_object_standard_format():
     assert pytz.timezone('Europe/Helsinki') == time_utils.ensure_tz_object('Europe/Helsinki')
 
@@ -324,6 +372,78 @@ def test_get_maybe_tz_from_date_objects_tz():
     assert time_utils.get_maybe_tz_from_date_objects(datetime.date(2018, 11, 3), datetime.datetime(2014, 12, 3, 5, tzinfo=pytz.timezone('Europe/Helsinki'))) == pytz.timezone('Europe/Helsinki')
 
 
+def test_get_maybe_tz_from_date_objects_canonical():
+    assert time_utils.get_maybe_tz_from_date_objects(datetime.datetime(2014, 12, 3, 5, tzinfo=tzoffset(None, 7200))) == pytz.FixedOffset(120)
+    assert time_utils.get_maybe_tz_from_date_objects(datetime.datetime(2014, 12, 3, 5, tzinfo=tzoffset(None, 0))) is pytz.utc
+
+
+def test_canonical_tz():
+    helsinki = pytz.timezone('Europe/Helsinki')
+    assert time_utils.canonical_tz('Europe/Helsinki') is helsinki
+    assert time_utils.canonical_tz(helsinki.localize(datetime.datetime(2018, 6, 1)).tzinfo) is helsinki
+    assert time_utils.canonical_tz(dateutil_tz.gettz('Europe/Helsinki')) is helsinki
+    assert time_utils.canonical_tz('US/Eastern') is pytz.timezone('America/New_York')
+    assert time_utils.canonical_tz(tzoffset(None, 0)) is pytz.utc
+    assert time_utils.canonical_tz(datetime.timezone.utc) is pytz.utc
+    assert time_utils.canonical_tz(tzoffset(None, -3600)) is pytz.FixedOffset(-60)
+
+
+def test_canonical_tz_id():
+    tz_id = time_utils.canonical_tz_id('Europe/Helsinki')
+    assert isinstance(tz_id, int)
+    assert time_utils.canonical_tz_by_id(tz_id) is pytz.timezone('Europe/Helsinki')
+    assert [tz_id, tz_id] == time_utils.canonical_tz_ids(['europe/helsinki', pytz.timezone('Europe/Helsinki')])
+
+
+def test_is_same_tz():
+    assert time_utils.is_same_tz('UTC', tzoffset(None, 0))
+    assert time_utils.is_same_tz('Asia/Calcutta', 'Asia/Kolkata')
+    assert time_utils.is_same_tz(tzoffset(None, 7200), datetime.timezone(datetime.timedelta(hours=2)))
+    assert not time_utils.is_same_tz(tzoffset(None, 7200), 'Europe/Helsinki')
+
+
+def test_is_same_tz_static_zones():
+    assert time_utils.is_same_tz('Etc/GMT', tzoffset(None, 0))
+    assert time_utils.is_same_tz('Etc/GMT', 'UTC')
+    assert time_utils.is_same_tz('Etc/GMT-2', tzoffset(None, 7200))
+    assert time_utils.is_same_tz('Etc/GMT+5', datetime.timezone(datetime.timedelta(hours=-5)))
+    assert time_utils.is_same_tz(dateutil_tz.gettz('Etc/GMT-2'), pytz.FixedOffset(120))
+    assert not time_utils.is_same_tz('Etc/GMT-2', 'Europe/Helsinki')
+    assert time_utils.canonical_tz('Etc/GMT-2') is pytz.FixedOffset(120)
+
+
+def test_canonical_tz_unnamed_tz_is_interned():
+    tz_count = len(time_utils._canonical_tzs)
+    for _ in range(100):
+        time_utils.get_maybe_tz_from_date_objects(datetime.datetime.now(dateutil_tz.tzlocal()))
+    assert len(time_utils._canonical_tzs) <= tz_count + 1
+    assert time_utils.is_same_tz(dateutil_tz.tzlocal(), dateutil_tz.tzlocal())
+    assert time_utils.canonical_tz(dateutil_tz.tzlocal()) == dateutil_tz.tzlocal()
+
+
+def test_canonical_tz_identity_compared_tz_is_not_registered():
+    class IdentityTz(datetime.tzinfo):
+        def utcoffset(self, dt):
+            return datetime.timedelta(hours=1)
+
+    tz_count = len(time_utils._canonical_tzs)
+    tz = IdentityTz()
+    assert time_utils.canonical_tz_id(tz) is None
+    assert time_utils.canonical_tz(tz) is tz
+    assert time_utils.is_same_tz(tz, tz)
+    assert not time_utils.is_same_tz(tz, IdentityTz())
+    assert len(time_utils._canonical_tzs) == tz_count
+
+
+def test_sub_minute_offset_can_be_localized():
+    tz = datetime.timezone(datetime.timedelta(seconds=30))
+    d1, d2 = time_utils.ensure_date_objects_are_comparable(datetime.date(2018, 11, 3), datetime.datetime(2018, 11, 3, 5, tzinfo=tz))
+    assert d1 == datetime.datetime(2018, 11, 3, tzinfo=tz)
+    start, end = time_utils.period_bounds([2018], 'year', tz)[0]
+    assert start == datetime.datetime(2018, 1, 1, tzinfo=tz)
+    assert end == datetime.datetime(2019, 1, 1, tzinfo=tz)
+
+
 def test_ensure_date_objects_are_comparable():
     d1 = datetime.date(2018, 11, 3)
     d2 = datetime.datetime(2014, 12, 3, 5, tzinfo=pytz.timezone('Europe/Helsinki'))
@@ -420,3 +540,297 @@ def test_relativedelta_to_timedelta_long_time():
     assert isinstance(res, datetime.timedelta)
     assert res.days == 366  # 2020 is leapyear ;)
     assert res.total_seconds() == 366 * 24 * 60 * 60
+
+
+@freeze_time("2017-11-13")
+def test_get_current_utc_offsets():
+    helsinki, kolkata, kathmandu, utc = time_utils.get_current_utc_offsets(['Europe/Helsinki', 'Asia/Kolkata', 'Asia/Kathmandu', 'UTC'])
+    assert helsinki == (2 * 3600, datetime.datetime(2018, 3, 25, 1, 0, tzinfo=pytz.utc))
+    assert kolkata == (5 * 3600 + 30 * 60, None)
+    assert kathmandu == (5 * 3600 + 45 * 60, None)
+    assert utc == (0, None)
+
+
+def test_get_current_utc_offsets_cache_expires_on_transition():
+    with freeze_time("2018-03-25 00:59:59"):
+        assert time_utils.get_current_utc_offsets(['Europe/Helsinki'])[0].offset == 2 * 3600
+    with freeze_time("2018-03-25 01:00:00"):
+        offset = time_utils.get_current_utc_offsets(['Europe/Helsinki'])[0]
+        assert offset.offset == 3 * 3600
+        assert offset.valid_until == datetime.datetime(2018, 10, 28, 1, 0, tzinfo=pytz.utc)
+
+
+@freeze_time("2017-06-13")
+def test_get_current_utc_offsets_tz_obj():
+    tz = tzoffset(None, -3600)
+    assert time_utils.get_current_utc_offsets([tz])[0] == (-3600, None)
+
+
+def test_datetime_format():
+    dt = datetime.datetime(2017, 11, 13, 12, 15, 1, 124000, tzinfo=pytz.utc)
+    assert "2017-11-13T12:15:01.124000Z" == time_utils.datetime_format(dt)
+    assert "2017-11-13T12:15:01.124Z" == time_utils.datetime_format(dt, 'milliseconds')
+    assert "2017-11-13T12:15:01+00:00" == time_utils.datetime_format(dt, 'seconds', use_z=False)
+    assert "2017-11-13T12:15:01.124000-06:00" == time_utils.datetime_format(dt.replace(tzinfo=tzoffset(None, -21600)))
+    assert "2017-11-13T12:15" == time_utils.datetime_format(dt.replace(tzinfo=None), 'minutes')
+
+
+def test_datetime_format_raises_on_invalid_timespec():
+    with pytest.raises(ValueError) as excinfo:
+        time_utils.datetime_format(datetime.datetime(2017, 11, 13), 'hours')
+
+    assert 'hours' in str(excinfo.value)
+
+
+def test_datetime_format_roundtrip():
+    for datetime_str in ["2017-11-13T12:15:01.124Z", "2017-11-13T12:15:01+02:00", "2017-11-13T12:15:01.999999-06:00", "2017-11-13T12:15"]:
+        dt = time_utils.datetime_parse(datetime_str)
+        assert time_utils.datetime_parse(time_utils.datetime_format(dt)) == dt
+
+
+def test_datetimes_format():
+    dts = [datetime.datetime(2017, 11, 13, 12, 15, 1, tzinfo=pytz.utc), datetime.datetime(2017, 11, 13, 12, 15, 1, 5000, tzinfo=tzoffset(None, 7200))]
+    assert ["2017-11-13T12:15:01.000Z", "2017-11-13T12:15:01.005+02:00"] == time_utils.datetimes_format(dts, 'milliseconds')
+    assert b"2017-11-13T12:15:01Z,2017-11-13T12:15:01+02:00" == time_utils.datetimes_format(dts, 'seconds', separator=',')
+
+
+def test_timestamps_format():
+    assert ["2017-11-28T13:34:25Z"] == time_utils.timestamps_format([1511876065])
+    assert ["2017-11-28T15:34:25.123+02:00"] == time_utils.timestamps_format([1511876065123], 'Europe/Helsinki', is_ms=True, timespec='milliseconds')
+    assert ["1969-12-31T23:59:58.500000Z"] == time_utils.timestamps_format([-1.5])
+    assert b"2018-03-25T02:59:59+02:00\n2018-03-25T04:00:00+03:00" == time_utils.timestamps_format([1521939599, 1521939600], 'Europe/Helsinki', separator=b'\n')
+    assert ["2017-11-28T19:19:25+05:45"] == time_utils.timestamps_format([1511876065], 'Asia/Kathmandu')
+
+
+def test_timestamps_format_matches_datetime_from_timestamp():
+    for timestamp in range(1500000000, 1600000000, 999999):
+        for tz in ['UTC', 'Europe/Helsinki', 'America/St_Johns']:
+            assert time_utils.datetime_format(time_utils.datetime_from_timestamp(timestamp, tz)) == time_utils.timestamps_format([timestamp], tz)[0]
+
+
+@pytest.fixture
+def tz_snapshot(tmp_path):
+    path = str(tmp_path / 'tz_snapshot.bin')
+    time_utils.compile_tz_snapshot(path)
+    yield time_utils.use_tz_snapshot(path)
+    time_utils.use_tz_snapshot(None)
+
+
+def test_tz_snapshot_utc_offset_table(tz_snapshot):
+    transition_times, offsets = tz_snapshot.utc_offset_table('europe/helsinki')
+    assert (list(transition_times), list(offsets)) == time_utils._build_utc_offset_table(pytz.timezone('Europe/Helsinki'))
+    assert tz_snapshot.utc_offset_table('US/Eastern') == tz_snapshot.utc_offset_table('America/New_York')
+    assert tz_snapshot.utc_offset_table('FLE Standard Time') == tz_snapshot.utc_offset_table('Europe/Kiev')
+    assert tz_snapshot.utc_offset_table('asd asd') is None
+
+
+def test_tz_snapshot_is_used(tz_snapshot):
+    assert time_utils._get_utc_offset_table('Europe/Helsinki') == tz_snapshot.utc_offset_table('Europe/Helsinki')
+    assert ["2017-11-28T15:34:25+02:00"] == time_utils.timestamps_format([1511876065], 'Europe/Helsinki')
+    assert 'FLE Standard Time' == time_utils.timezone_to_microsoft_timezone('Europe/Helsinki')
+    assert 'Europe/Helsinki' == time_utils.microsoft_timezone_to_timezone('FLE Standard Time', 'FI')
+
+
+@freeze_time("2017-11-13")
+def test_tz_snapshot_current_utc_offsets(tz_snapshot):
+    assert [(2 * 3600, datetime.datetime(2018, 3, 25, 1, 0, tzinfo=pytz.utc))] == time_utils.get_current_utc_offsets(['Europe/Helsinki'])
+
+
+def test_tz_snapshot_raises_on_invalid_file(tmp_path):
+    path = tmp_path / 'invalid.bin'
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError) as excinfo:
+        time_utils.TzSnapshot(str(path))
+
+    assert f'not a version {time_utils.TZ_SNAPSHOT_VERSION} timezone snapshot' in str(excinfo.value)
+
+
+def test_tz_snapshot_raises_on_truncated_file(tmp_path):
+    path = tmp_path / 'tz_snapshot.bin'
+    time_utils.compile_tz_snapshot(str(path))
+    data = path.read_bytes()
+    for size in [len(data) - 1, len(data) // 2, time_utils._TZ_SNAPSHOT_HEADER.size + 3, 10]:
+        path.write_bytes(data[:size])
+        with pytest.raises(ValueError):
+            time_utils.TzSnapshot(str(path))
+
+    path.write_bytes(data[:-1])
+    with pytest.raises(ValueError) as excinfo:
+        time_utils.TzSnapshot(str(path))
+
+    assert f'truncated, expected {len(data)} bytes, got {len(data) - 1}' in str(excinfo.value)
+
+
+def test_tz_snapshot_is_little_endian(tmp_path):
+    path = tmp_path / 'tz_snapshot.bin'
+    time_utils.compile_tz_snapshot(str(path))
+    data = path.read_bytes()
+    header = time_utils._TZ_SNAPSHOT_HEADER
+    zone_count, transition_count = struct.unpack_from('<II', data, 8)
+    records_offset = header.size
+    transition_times_offset = time_utils._align(records_offset + 8 * zone_count)
+    first_transition = struct.unpack_from('<q', data, transition_times_offset)[0]
+    assert first_transition == (datetime.datetime.min - datetime.datetime(1970, 1, 1)) // datetime.timedelta(seconds=1)
+    assert transition_count == sum(struct.unpack_from(f'<{2 * zone_count}I', data, records_offset)[1::2])
+
+
+def test_tz_snapshot_raises_on_pytz_version_mismatch(tmp_path, monkeypatch):
+    path = str(tmp_path / 'tz_snapshot.bin')
+    time_utils.compile_tz_snapshot(path)
+    monkeypatch.setattr(time_utils, '_pytz_version', lambda: '2000.1/2000a')
+    with pytest.raises(ValueError) as excinfo:
+        time_utils.TzSnapshot(path)
+
+    assert 'installed pytz is 2000.1/2000a' in str(excinfo.value)
+
+
+def test_period_keys():
+    # 2017-11-28T15:34:25+02:00, 2018-03-25T02:59:59+02:00, 2018-03-25T04:00:00+03:00
+    timestamps = [1511876065, 1521939599, 1521939600]
+    assert [17498, 17615, 17615] == time_utils.period_keys(timestamps, 'day', 'Europe/Helsinki')
+    assert [2017 * 12 + 10, 2018 * 12 + 2, 2018 * 12 + 2] == time_utils.period_keys(timestamps, 'month', 'Europe/Helsinki')
+    assert [2017 * 4 + 3, 2018 * 4, 2018 * 4] == time_utils.period_keys(timestamps, 'quarter', 'Europe/Helsinki')
+    assert [2017, 2018, 2018] == time_utils.period_keys(timestamps, 'year', 'Europe/Helsinki')
+    assert [2018, 2018, 2018] == time_utils.period_keys(timestamps, 'fiscal_year', 'Europe/Helsinki', fiscal_year_start_month=7)
+    assert [2018 * 4 + 1, 2018 * 4 + 2, 2018 * 4 + 2] == time_utils.period_keys(timestamps, 'fiscal_quarter', 'Europe/Helsinki', fiscal_year_start_month=7)
+
+
+def test_period_keys_local_day_boundary():
+    dt = datetime.datetime(2017, 12, 31, 22, 30, tzinfo=pytz.utc)
+    assert [2017] == time_utils.period_keys([dt], 'year')
+    assert [2018] == time_utils.period_keys([dt], 'year', 'Europe/Helsinki')
+    assert [2018] == time_utils.period_keys([int(dt.timestamp() * 1000)], 'year', 'Europe/Helsinki', is_ms=True)
+    assert [2017] == time_utils.period_keys([datetime.datetime(2017, 12, 31, 23, 30)], 'year', 'Europe/Helsinki')
+
+
+def test_period_keys_raises_on_invalid_period():
+    with pytest.raises(ValueError) as excinfo:
+        time_utils.period_keys([0], 'decade')
+
+    assert 'decade' in str(excinfo.value)
+
+
+def test_period_bounds():
+    month, = time_utils.period_keys([datetime.date(2018, 11, 13)], 'month')
+    assert [(time_utils.first_moment_of_month(2018, 11, 'Europe/Helsinki'), time_utils.first_moment_of_month(2018, 12, 'Europe/Helsinki'))] == time_utils.period_bounds([month], 'month', 'Europe/Helsinki')
+
+    week, = time_utils.period_keys([datetime.date(2018, 11, 13)], 'iso_week')
+    start, end = time_utils.period_bounds([week], 'iso_week', 'Europe/Helsinki')[0]
+    assert start == time_utils.beginning_of_day(datetime.date(2018, 11, 12), 'Europe/Helsinki')
+    assert end == time_utils.beginning_of_day(datetime.date(2018, 11, 19), 'Europe/Helsinki')
+
+    start, end = time_utils.period_bounds([2019], 'fiscal_year', 'UTC', fiscal_year_start_month=7)[0]
+    assert start == datetime.datetime(2018, 7, 1, tzinfo=pytz.utc)
+    assert end == datetime.datetime(2019, 7, 1, tzinfo=pytz.utc)
+
+
+def test_event_time_windows_tumbling():
+    windows = time_utils.EventTimeWindows(size=10, allowed_lateness=5)
+    assert windows.add(1)
+    assert windows.add(12)
+    assert [] == list(windows.closed_windows())
+    assert windows.add(3)
+    assert windows.add(16)
+    assert [(None, 0, 10, 2)] == list(windows.closed_windows())
+    assert not windows.add(2)
+    assert 1 == windows.late_events
+    assert [(None, 10, 20, 2)] == list(windows.flush())
+    assert 0 == len(windows)
+
+
+def test_event_time_windows_matches_floor_datetime():
+    windows = time_utils.EventTimeWindows(size=15 * 60)
+    dt = datetime.datetime(2019, 3, 19, 7, 38, 4, tzinfo=pytz.utc)
+    windows.add(int(dt.timestamp()))
+    window, = windows.flush()
+    assert time_utils.datetime_from_timestamp(window.start) == time_utils.floor_datetime(dt, minutes=15)
+    assert time_utils.datetime_from_timestamp(window.end) == time_utils.ceil_datetime(dt, minutes=15)
+
+
+def test_event_time_windows_hopping():
+    windows = time_utils.EventTimeWindows(size=10, slide=5, initializer=list, reducer=lambda acc, value: acc + [value])
+    for timestamp in [1, 7, 12]:
+        windows.add(timestamp, timestamp)
+    assert [(None, -5, 5, [1]), (None, 0, 10, [1, 7])] == list(windows.closed_windows())
+    assert [(None, 5, 15, [7, 12]), (None, 10, 20, [12])] == list(windows.flush())
+
+
+def test_event_time_windows_session():
+    windows = time_utils.EventTimeWindows(gap=10)
+    for timestamp in [1, 5, 30, 14, 12, 50, 100, 41]:
+        windows.add(timestamp, key='a')
+    windows.add(3, key='b')
+    assert [('a', 1, 15, 2), ('a', 30, 40, 1), ('a', 50, 60, 1)] == list(windows.closed_windows())
+    assert 4 == windows.late_events  # watermark is shared by all keys
+    assert [('a', 100, 110, 1)] == list(windows.flush())
+
+
+def test_event_time_windows_session_late_event_does_not_overlap_closed_session():
+    windows = time_utils.EventTimeWindows(gap=10)
+    windows.add(0)
+    windows.add(12)
+    assert not windows.add(5)
+    assert 1 == windows.late_events
+    assert [(None, 0, 10, 1), (None, 12, 22, 1)] == list(windows.flush())
+
+
+def test_event_time_windows_session_late_event_does_not_overlap_emitted_session():
+    windows = time_utils.EventTimeWindows(gap=10)
+    windows.add(0)
+    windows.add(12)
+    assert [(None, 0, 10, 1)] == list(windows.closed_windows())
+    assert not windows.add(5)
+    assert windows.add(15)
+    assert 1 == windows.late_events
+    assert [(None, 12, 25, 2)] == list(windows.flush())
+
+
+def test_event_time_windows_session_merge():
+    windows = time_utils.EventTimeWindows(gap=10, allowed_lateness=100)
+    for timestamp in [1, 28, 19, 10]:
+        windows.add(timestamp)
+    assert 1 == len(windows)
+    assert [(None, 1, 38, 4)] == list(windows.flush())
+
+
+def test_event_time_windows_session_heap_is_bounded():
+    windows = time_utils.EventTimeWindows(gap=10, allowed_lateness=10 ** 9, max_open_windows=10)
+    for timestamp in range(100000):
+        windows.add(timestamp)
+    assert 1 == len(windows)
+    assert len(windows._ends) <= 2 * len(windows) + 64
+    assert [(None, 0, 100009, 100000)] == list(windows.flush())
+
+
+def test_event_time_windows_max_open_windows():
+    windows = time_utils.EventTimeWindows(size=10, allowed_lateness=1000, max_open_windows=2)
+    for timestamp in [1, 12, 25, 3]:
+        windows.add(timestamp)
+    assert [(None, 0, 10, 1)] == list(windows.closed_windows())
+    assert 10 == windows.watermark
+    assert 1 == windows.late_events
+
+
+def test_event_time_windows_raises_on_invalid_arguments():
+    with pytest.raises(ValueError):
+        time_utils.EventTimeWindows()
+    with pytest.raises(ValueError):
+        time_utils.EventTimeWindows(size=10, gap=10)
+    with pytest.raises(ValueError):
+        time_utils.EventTimeWindows(gap=10, reducer=lambda acc, value: acc + value)
+    with pytest.raises(ValueError):
+        time_utils.EventTimeWindows(size=10, max_open_windows=-1)
+    with pytest.raises(ValueError) as excinfo:
+        time_utils.EventTimeWindows(size=5, slide=10)
+
+    assert 'slide' in str(excinfo.value)
+
+
+def test_datetimes_format_matches_isoformat():
+    tzs = [pytz.utc, pytz.timezone('Europe/Helsinki'), pytz.timezone('Asia/Kathmandu'), tzoffset(None, -30), None]
+    dts = [
+        time_utils.datetime_from_timestamp(timestamp + microsecond / 1000000).astimezone(tz) if tz else datetime.datetime.utcfromtimestamp(timestamp)
+        for timestamp, microsecond, tz in zip(range(1500000000, 1600000000, 999999), [0, 250000, 123456] * 40, tzs * 25)
+    ]
+    for timespec in ['auto', 'minutes', 'seconds', 'milliseconds', 'microseconds']:
+        assert [dt.isoformat(timespec=timespec) for dt in dts] == time_utils.datetimes_format(dts, timespec, use_z=False)